@@ -3,20 +3,22 @@
 Lambda Durable Functions デモ用データ生成スクリプト
 
 使用方法:
+    pip install numpy
     python generate_demo_data.py
 """
 
 import csv
-import random
+import gzip
 import os
-from datetime import datetime, timedelta
+
+import numpy as np
 
 # 設定
 NUM_RECORDS = 10000
 HIGH_VALUE_COUNT = 50
 DATE = "2025-01-15"
 OUTPUT_DIR = "sales"
-OUTPUT_FILE = f"{OUTPUT_DIR}/{DATE}.csv"
+OUTPUT_FILE = f"{OUTPUT_DIR}/{DATE}.csv.gz"  # S3転送量削減のためgzip圧縮
 
 # 商品リスト（商品名, 最小価格, 最大価格, カテゴリ）
 PRODUCTS = [
@@ -43,45 +45,61 @@ HIGH_VALUE_PRODUCTS = [
 REGIONS = ["東京", "大阪", "名古屋", "福岡", "札幌", "仙台", "広島", "横浜"]
 
 
+def frozen_array(values):
+    array = np.array(values)
+    array.flags.writeable = False
+    return array
+
+
+# 商品・地域を列ごとの配列に展開（高額商品は PRODUCTS の後ろに続く番号で参照）
+PRODUCT_NAMES = frozen_array([p[0] for p in PRODUCTS] + [p[0] for p in HIGH_VALUE_PRODUCTS])
+PRODUCT_CATEGORIES = frozen_array([p[3] for p in PRODUCTS] + [p[1] for p in HIGH_VALUE_PRODUCTS])
+PRODUCT_MIN_PRICES = frozen_array([p[1] for p in PRODUCTS])
+PRODUCT_MAX_PRICES = frozen_array([p[2] for p in PRODUCTS])
+REGION_NAMES = frozen_array(REGIONS)
+
+
 def generate_data():
-    data = []
-    base_date = datetime.fromisoformat(f"{DATE}T00:00:00")
-    high_value_indices = set(random.sample(range(NUM_RECORDS), HIGH_VALUE_COUNT))
-
-    for i in range(NUM_RECORDS):
-        # 会社名はシンプルに
-        company = f"会社{chr(65 + (i % 26))}{i // 26 + 1}"  # 会社A1, 会社B1, ...
-
-        if i in high_value_indices:
-            # 高額取引（100万円以上）
-            amount = random.randint(1000000, 5000000)
-            product_name, category = random.choice(HIGH_VALUE_PRODUCTS)
-        else:
-            # 通常取引
-            product_name, min_price, max_price, category = random.choice(PRODUCTS)
-            amount = random.randint(min_price, max_price)
-
-        data.append({
-            "id": f"{i+1:05d}",
-            "customer_name": company,
-            "product": product_name,
-            "amount": amount,
-            "quantity": random.randint(1, 10),
-            "region": random.choice(REGIONS),
-            "category": category,
-            "timestamp": (base_date + timedelta(seconds=i * 8)).isoformat()
-        })
-
-    return data
+    rng = np.random.default_rng()
+    idx = np.arange(NUM_RECORDS)
+    is_high_value = np.zeros(NUM_RECORDS, dtype=bool)
+    is_high_value[rng.choice(NUM_RECORDS, HIGH_VALUE_COUNT, replace=False)] = True
+
+    # 通常取引
+    prod_idx = rng.integers(0, len(PRODUCTS), NUM_RECORDS)
+    amount = rng.integers(PRODUCT_MIN_PRICES[prod_idx], PRODUCT_MAX_PRICES[prod_idx] + 1)
+
+    # 高額取引（100万円以上）で上書き
+    high_prod_idx = len(PRODUCTS) + rng.integers(0, len(HIGH_VALUE_PRODUCTS), NUM_RECORDS)
+    prod_idx = np.where(is_high_value, high_prod_idx, prod_idx)
+    amount = np.where(is_high_value, rng.integers(1000000, 5000001, NUM_RECORDS), amount)
+
+    # 会社名はシンプルに（会社A1, 会社B1, ...）
+    letters = np.array([chr(65 + n) for n in range(26)])
+    company = np.char.add(np.char.add("会社", letters[idx % 26]), (idx // 26 + 1).astype(str))
+
+    base_date = np.datetime64(f"{DATE}T00:00:00")
+    timestamp = base_date + idx * np.timedelta64(8, "s")
+
+    return {
+        "id": np.char.zfill((idx + 1).astype(str), 5),
+        "customer_name": company,
+        "product": PRODUCT_NAMES[prod_idx],
+        "amount": amount,
+        "quantity": rng.integers(1, 11, NUM_RECORDS),
+        "region": REGION_NAMES[rng.integers(0, len(REGION_NAMES), NUM_RECORDS)],
+        "category": PRODUCT_CATEGORIES[prod_idx],
+        "timestamp": np.datetime_as_string(timestamp, unit="s"),
+    }
 
 
 def save_to_csv(data):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     fieldnames = ["id", "customer_name", "product", "amount", "quantity", "region", "category", "timestamp"]
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
+    with gzip.open(OUTPUT_FILE, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        writer.writerows(zip(*(data[name].tolist() for name in fieldnames)))
 
 
 def main():
@@ -90,17 +108,17 @@ def main():
     save_to_csv(data)
 
     # サマリー
-    total = sum(d['amount'] for d in data)
-    high_value = [d for d in data if d['amount'] >= 1000000]
+    total = int(data['amount'].sum())
+    high_value_count = int((data['amount'] >= 1000000).sum())
 
     print(f"\n=== Summary ===")
-    print(f"Total records: {len(data):,}")
+    print(f"Total records: {len(data['id']):,}")
     print(f"Total sales: ¥{total:,}")
-    print(f"High-value (>=¥1,000,000): {len(high_value)} records")
+    print(f"High-value (>=¥1,000,000): {high_value_count} records")
     print(f"File: {OUTPUT_FILE}")
     print(f"\n=== Next Steps ===")
     print(f"aws s3 mb s3://YOUR-BUCKET --region ap-northeast-1")
-    print(f"aws s3 cp {OUTPUT_FILE} s3://YOUR-BUCKET/sales/{DATE}.csv")
+    print(f"aws s3 cp {OUTPUT_FILE} s3://YOUR-BUCKET/sales/{DATE}.csv.gz")
 
 
 if __name__ == "__main__":
@@ -1,10 +1,16 @@
 import json
 import csv
 import os
-import time
-from io import StringIO
+from gzip import GzipFile
+from io import BytesIO, StringIO, TextIOWrapper
+from itertools import chain, compress
+from typing import BinaryIO
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.compat import HAS_CRT
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from aws_durable_execution_sdk_python import DurableContext, durable_execution, durable_step
 from aws_durable_execution_sdk_python.config import Duration, MapConfig, CallbackConfig, CompletionConfig, StepConfig
 
@@ -15,83 +21,117 @@ BUCKET_NAME = os.environ.get('BUCKET_NAME', '')  # S3バケット名（売上デ
 HIGH_VALUE_THRESHOLD = 1000000                    # 高額取引の閾値（100万円以上は承認必要）
 BATCH_SIZE = 100                                  # context.map での並列処理単位
 API_BATCH_SIZE = 1000                             # 外部API連携時のバッチサイズ
-API_RATE_LIMIT_WAIT_SECONDS = 10                  # 外部API連携時のレート制限待機秒数
+API_MAX_CONCURRENCY = 5                           # 外部API連携の同時実行数（レート制限に合わせて調整）
+# 売上CSVの列（空ファイルでヘッダーが無い場合に使用）
+SALES_COLUMNS = ['id', 'customer_name', 'product', 'amount', 'quantity', 'region', 'category', 'timestamp']
+
+s3 = boto3.client('s3', config=Config(max_pool_connections=64))
+# 閾値を超えるオブジェクトはマネージド転送でバイトレンジGET/マルチパートPUTに分割して並列転送
+# awscrt が利用可能な環境（boto3[crt]）では CRT ベースの転送マネージャを使用
+s3_transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    use_threads=True,
+    max_concurrency=30,
+    preferred_transfer_client='crt' if HAS_CRT else 'classic'
+)
 
-s3 = boto3.client('s3')
+
+# =============================================================================
+# S3オブジェクトをバイナリのファイルオブジェクトとして開く
+# まずGETし、マルチパート閾値以下ならレスポンスをそのままストリームとして返却
+# （小さいオブジェクトはHEADを挟まず1リクエストで完結）
+# それ以上はGETを破棄し、マネージド転送で並列ダウンロードしてバッファに格納
+# =============================================================================
+def open_object(bucket: str, key: str) -> BinaryIO:
+    response = s3.get_object(Bucket=bucket, Key=key)
+    if response['ContentLength'] <= s3_transfer_config.multipart_threshold:
+        return response['Body']
+
+    response['Body'].close()
+    body = BytesIO()
+    s3.download_fileobj(bucket, key, body, Config=s3_transfer_config)
+    body.seek(0)
+    return body
 
 
 # =============================================================================
 # S3から売上データを取得
-# CSVファイルを読み込み、各行をdict形式に変換して返却
+# CSVファイル（.gz の場合はgzip展開しながら）を列単位で読み込み、{列名: 値のリスト} 形式で返却
 # =============================================================================
-def fetch_sales_data(context: DurableContext, bucket: str, key: str) -> list:
-    response = s3.get_object(Bucket=bucket, Key=key)
-    content = response['Body'].read().decode('utf-8')
-    reader = csv.DictReader(StringIO(content))
-    records = [
-        {
-            'id': row['id'],
-            'customer_name': row['customer_name'],
-            'product': row['product'],
-            'amount': int(row['amount']),
-            'quantity': int(row['quantity']),
-            'region': row['region'],
-            'category': row['category'],
-            'timestamp': row['timestamp']
-        }
-        for row in reader
-    ]
+def fetch_sales_data(context: DurableContext, bucket: str, key: str) -> dict:
+    with open_object(bucket, key) as body:
+        stream = GzipFile(fileobj=body) if key.endswith('.gz') else body
+        reader = csv.reader(TextIOWrapper(stream, encoding='utf-8', newline=''))
+        # 空行は読み飛ばし、空ファイルはヘッダーのみのCSVと同様に0件として扱う
+        rows = filter(None, reader)
+        header = next(rows, None) or SALES_COLUMNS
+        rows = list(rows)
+    # 列数がヘッダーと異なる行はエラーにする（zipで黙って切り詰めない）
+    for row in rows:
+        if len(row) != len(header):
+            raise ValueError(f'{key}: 列数がヘッダーと一致しません（{len(row)}列/{len(header)}列）: {row}')
+    # 列単位に転置し、数値列はパース時に1回だけ変換
+    columns = dict.fromkeys(header, ())
+    columns.update(zip(header, zip(*rows)))
+    columns['amount'] = list(map(int, columns['amount']))
+    columns['quantity'] = list(map(int, columns['quantity']))
     context.logger.info({
         "action": "売上データ取得",
         "details": {
             "bucket": bucket,
             "key": key,
-            "record_count": len(records)
+            "record_count": len(columns['id'])
         }
     })
-    return records
+    return columns
 
 
 # =============================================================================
-# 1件のレコードを検証・加工
-# 税額(10%)と合計金額を計算し、処理済みフラグを付与
+# 列形式のデータを1パスでdict形式の2つの行リストに振り分け
+# mask が真の行は1つ目、偽の行は2つ目のリストに格納
+# 外部API連携・レポート出力など、行単位のデータが必要な箇所でのみ使用
 # =============================================================================
-def process_record(record: dict) -> dict:
-    time.sleep(0.05)
-    return {
-        **record,
-        'tax': int(record['amount'] * 0.1),
-        'total': int(record['amount'] * 1.1),
-        'processed': True
-    }
+def partition_rows(columns: dict, mask: list) -> tuple:
+    matched, unmatched = [], []
+    for row, is_match in zip(zip(*columns.values()), mask):
+        (matched if is_match else unmatched).append(dict(zip(columns, row)))
+    return matched, unmatched
 
 
 # =============================================================================
-# バッチ内の全レコードを処理
+# バッチ内の全レコードを検証・加工
 # context.mapから呼び出され、バッチ単位で並列実行される
+# 金額列のスライスを受け取り、税額(10%)・合計金額・処理済みフラグの列を返却
+# 税額は浮動小数点を介さず整数演算で計算
 # =============================================================================
-def process_batch(ctx: DurableContext, batch: list, index: int, all_batches: list) -> list:
+def process_batch(ctx: DurableContext, amounts: list, index: int, all_batches: list) -> dict:
     ctx.logger.info({
         "action": "バッチ処理",
         "details": {
             "batch_index": index,
             "batch_total": len(all_batches),
-            "record_count": len(batch)
+            "record_count": len(amounts)
         }
     })
-    return [process_record(record) for record in batch]
+    tax = [amount // 10 for amount in amounts]
+    return {
+        'tax': tax,
+        'total': [amount + t for amount, t in zip(amounts, tax)],
+        'processed': [True] * len(amounts)
+    }
 
 
 # =============================================================================
 # 高額取引のIDリストを抽出
 # =============================================================================
 @durable_step
-def extract_high_value_ids(step_context, records: list, threshold: int) -> list:
-    high_value_ids = [r['id'] for r in records if r['amount'] >= threshold]
+def extract_high_value_ids(step_context, records: dict, threshold: int) -> list:
+    high_value_ids = [id for id, amount in zip(records['id'], records['amount']) if amount >= threshold]
     step_context.logger.info({
         "action": "高額取引抽出",
         "details": {
-            "total_records": len(records),
+            "total_records": len(records['id']),
             "high_value_count": len(high_value_ids),
             "threshold": threshold
         }
@@ -142,28 +182,56 @@ def sync_to_external_api(step_context, records: list) -> dict:
     return {'synced': len(records)}
 
 
+# =============================================================================
+# 承認済みレコードの1バッチを外部会計APIに連携
+# context.mapから呼び出され、API_MAX_CONCURRENCY 件まで同時実行される
+# =============================================================================
+def sync_batch(ctx: DurableContext, batch: list, index: int, all_batches: list) -> dict:
+    return ctx.step(
+        sync_to_external_api(batch),
+        config=StepConfig(retry_strategy=lambda e, n: {
+            'should_retry': n < 5,           # 最大5回リトライ
+            'delay': min(5 * 2**(n-1), 60)  # 指数バックオフ: 5s→10s→20s→40s、上限60s
+        })
+    )
+
+
+# =============================================================================
+# レポートをS3保存用のJSONバイト列に変換
+# 区切り文字の空白を省いて出力サイズを削減し、UTF-8へのエンコードは1回のみ
+# =============================================================================
+def dump_report(report: dict) -> bytes:
+    return json.dumps(report, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# =============================================================================
+# dict形式のレコード一覧をS3保存用のCSVバイト列に変換
+# 全レコードが同じ列を持つ前提で、先頭レコードのキーをヘッダーとして使用
+# =============================================================================
+def dump_records_csv(records: list) -> bytes:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(records[0].keys())
+    writer.writerows(record.values() for record in records)
+    return buffer.getvalue().encode('utf-8')
+
+
 # =============================================================================
 # 最終レポート生成
-# 却下詳細（rejected_records がある場合）と集計サマリーの両方をS3に保存
+# 却下詳細CSV（rejected_records がある場合）と集計サマリーJSONの両方をS3に保存
 # =============================================================================
 @durable_step
-def generate_report(step_context, bucket: str, date: str, approved_records: list, rejected_records: list) -> dict:
-    # 却下詳細レポート（却下がある場合のみ）
+def generate_report(step_context, bucket: str, date: str, approved_records: list, rejected_records: list,
+                    approved_sales: int, rejected_sales: int) -> dict:
+    # 却下詳細（却下がある場合のみ）
+    # 同じ列を持つレコードの一覧のため、JSONではなく売上データと同じCSV形式で保存
     rejected_url = None
     if rejected_records:
-        rejected_report = {
-            'date': date,
-            'rejected_count': len(rejected_records),
-            'total_amount': sum(r['amount'] for r in rejected_records),
-            'records': rejected_records
-        }
-        rejected_key = f'rejected/{date}-rejected.json'
-        s3.put_object(Bucket=bucket, Key=rejected_key, Body=json.dumps(rejected_report, ensure_ascii=False))
+        rejected_key = f'rejected/{date}-rejected.csv'
+        s3.upload_fileobj(BytesIO(dump_records_csv(rejected_records)), bucket, rejected_key, Config=s3_transfer_config)
         rejected_url = f's3://{bucket}/{rejected_key}'
 
     # 集計サマリーレポート
-    approved_sales = sum(r['amount'] for r in approved_records)
-    rejected_sales = sum(r['amount'] for r in rejected_records)
     summary_report = {
         'date': date,
         'summary': {
@@ -174,7 +242,7 @@ def generate_report(step_context, bucket: str, date: str, approved_records: list
         }
     }
     summary_key = f'reports/{date}-report.json'
-    s3.put_object(Bucket=bucket, Key=summary_key, Body=json.dumps(summary_report, ensure_ascii=False))
+    s3.put_object(Bucket=bucket, Key=summary_key, Body=dump_report(summary_report))
     step_context.logger.info({
         "action": "最終レポート生成",
         "details": {
@@ -201,10 +269,19 @@ def lambda_handler(event: dict, context: DurableContext) -> dict:
     date = event['date']
 
     # === Step 1: S3から売上データ取得 ===
-    records = fetch_sales_data(context, bucket, f'sales/{date}.csv')
+    # gzip圧縮版（.csv.gz）を優先し、無ければ非圧縮の .csv を読み込む
+    # （ListBucket権限が無い場合、存在しないキーは AccessDenied になるため併せて扱う）
+    try:
+        records = fetch_sales_data(context, bucket, f'sales/{date}.csv.gz')
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', 'AccessDenied'):
+            raise
+        records = fetch_sales_data(context, bucket, f'sales/{date}.csv')
 
     # === Step 2: 全レコードを検証・加工（バッチ並列処理） ===
-    batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+    record_count = len(records['id'])
+    amounts = records['amount']
+    batches = [amounts[i:i + BATCH_SIZE] for i in range(0, record_count, BATCH_SIZE)]
     map_result = context.map(
         batches,
         process_batch,
@@ -214,16 +291,22 @@ def lambda_handler(event: dict, context: DurableContext) -> dict:
             completion_config=CompletionConfig.all_successful()
         )
     )
-    processed = []
-    for batch_result in map_result.get_results():
-        processed.extend(batch_result)
+    # バッチごとの結果を列単位で連結して元の列に追加
+    # 列は行の位置で対応付けるため、欠けたバッチがあれば連結前に失敗させる
+    map_result.throw_if_error()
+    batch_results = map_result.get_results()
+    processed = dict(records)
+    for name in ('tax', 'total', 'processed'):
+        processed[name] = list(chain.from_iterable(result[name] for result in batch_results))
+        if len(processed[name]) != record_count:
+            raise ValueError(f'{name} 列の件数がレコード数と一致しません（{len(processed[name])}件/{record_count}件）')
 
     # === Step 3: 高額取引のIDを抽出 ===
     high_value_ids = context.step(extract_high_value_ids(processed, HIGH_VALUE_THRESHOLD))
 
     # === Step 4: 高額取引の承認フロー ===
-    approved_ids = []
-    rejected_ids = []
+    # 行ごとの所属判定に使うため set で保持
+    approved_ids = frozenset()
 
     if high_value_ids:
         callback = context.create_callback(
@@ -233,43 +316,47 @@ def lambda_handler(event: dict, context: DurableContext) -> dict:
         context.step(send_approval_request(callback.callback_id, len(high_value_ids), date))
 
         approval_result = json.loads(callback.result() or '{}')
-        approved_ids = approval_result.get('approved_ids', [])
-        rejected_ids = [id for id in high_value_ids if id not in approved_ids]
-
-        if rejected_ids:
-            rejected_records = [r for r in processed if r['id'] in rejected_ids]
+        approved_ids = frozenset(approval_result.get('approved_ids', []))
 
     # === Step 5: 承認済みデータを外部会計APIに連携 ===
-    approved_records = [
-        r for r in processed
-        if r['amount'] < HIGH_VALUE_THRESHOLD or r['id'] in approved_ids
+    # 閾値未満または承認済みのレコードを連携対象とし、残り（未承認の高額取引）を却下として1パスで振り分け
+    approved_mask = [
+        amount < HIGH_VALUE_THRESHOLD or id in approved_ids
+        for id, amount in zip(processed['id'], amounts)
     ]
-
-    for i in range(0, len(approved_records), API_BATCH_SIZE):
-        batch = approved_records[i:i + API_BATCH_SIZE]
-        context.step(
-            sync_to_external_api(batch),
-            config=StepConfig(retry_strategy=lambda e, n: {
-                'should_retry': n < 5,           # 最大5回リトライ
-                'delay': min(5 * 2**(n-1), 60)  # 指数バックオフ: 5s→10s→20s→40s、上限60s
-            })
+    approved_records, rejected_records = partition_rows(processed, approved_mask)
+
+    # 固定時間の待機は挟まず、同時実行数の上限でレート制限を守る
+    api_batches = [approved_records[i:i + API_BATCH_SIZE] for i in range(0, len(approved_records), API_BATCH_SIZE)]
+    sync_result = context.map(
+        api_batches,
+        sync_batch,
+        name='sync-external-api',
+        config=MapConfig(
+            max_concurrency=API_MAX_CONCURRENCY,
+            completion_config=CompletionConfig.all_successful()
         )
-        if i + API_BATCH_SIZE < len(approved_records):
-            context.wait(Duration.from_seconds(API_RATE_LIMIT_WAIT_SECONDS))
+    )
+    # リトライ上限に達したバッチがあれば、未連携のまま完了扱いにせず実行を失敗させる
+    sync_result.throw_if_error()
 
     # === Step 6: 最終レポート生成 ===
-    rejected_records = [r for r in processed if r['id'] in rejected_ids]
+    # 売上は金額列から集計（却下分は全体との差分）
+    approved_sales = sum(compress(amounts, approved_mask))
+    rejected_sales = sum(amounts) - approved_sales
 
     report = context.step(generate_report(
         bucket, date,
         approved_records,
-        rejected_records
+        rejected_records,
+        approved_sales,
+        rejected_sales
     ))
 
     return {
         'status': 'completed',
         'date': date,
-        'total_records': len(records),
+        'total_records': record_count,
         'approved_records': len(approved_records),
         'rejected_records': len(rejected_records),
         'report_url': report['summary_url']